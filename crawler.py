@@ -1,120 +1,267 @@
 from page_parser import PageParser
-from collections import deque
-from page import Page
+from host_scheduler import HostQueue, HostScheduler
+from page import Page, dump_pages
 from typing import List, Tuple
 import numpy as np
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor
+import itertools
 import threading
 import json
 import os
-import re
 from page_rank import PageRank
-from queue import Queue
+from collections import deque
 
 
 class Crawler(object):
-    def __init__(self,initial_url,max_pages=300, dump_dir="page_data") -> None:
+    def __init__(self,initial_url,max_pages=300, dump_dir="page_data", num_shards=16, max_retries=3, scheduler=None) -> None:
         self.parser = PageParser()
-        self.url_queue=Queue()
+        # per-host concurrency, politeness and backoff, `num_workers` only bounds the total
+        self.scheduler = scheduler if scheduler is not None else HostScheduler()
+        self.max_retries = max_retries
+        # failed attempts of urls waiting on their host's queue for a retry, they keep their slot
+        self.attempts = {}
+        # hands out urls only when their host has capacity, so no worker waits on a throttled host
+        self.url_queue=HostQueue(self.scheduler)
         self.page_to_id = {}
-        self.lock=threading.Lock()
         self.pages=[]
         self.initial_url=initial_url
         self.max_pages=max_pages
         self.dump_dir=dump_dir
         self.connectivity_matrix = None
         self.bar=None
+        # seen urls are sharded by hash so that workers discovering links
+        # from different pages rarely contend on the same lock
+        self.seen_shards=[set() for _ in range(num_shards)]
+        self.seen_locks=[threading.Lock() for _ in range(num_shards)]
+        # `reserved` counts fetches that hold (or already used) one of the
+        # `max_pages` slots, it is only touched under `slot_lock`
+        self.slot_lock=threading.Lock()
+        self.reserved=0
+        # urls that found every slot taken, re-queued when a failed fetch gives its slot back
+        self.parked=deque()
+        self.id_counter=itertools.count()
+        # called with every fetched `Page` from the worker threads, may block to apply back-pressure
+        self.on_page=None
+
+    def claim_url(self, url: str) -> bool:
+        '''
+        returns True if `url` has never been seen before, so exactly one worker enqueues it
+        '''
+        shard = hash(url) % len(self.seen_shards)
+        with self.seen_locks[shard]:
+            if url in self.seen_shards[shard]:
+                return False
+            self.seen_shards[shard].add(url)
+            return True
+
+    def reserve_slot(self, url: str) -> bool:
+        '''
+        returns True if `url` may be fetched, otherwise it is parked until a slot is released
+        '''
+        with self.slot_lock:
+            if self.reserved >= self.max_pages:
+                self.parked.append(url)
+                return False
+            self.reserved += 1
+            return True
+
+    def release_slot(self):
+        with self.slot_lock:
+            self.reserved -= 1
+            if self.parked:
+                # put back before the releasing task is done, so `url_queue.join` keeps waiting for it
+                self.url_queue.put(self.parked.popleft())
 
-    def crawl(self,url:str,parent_id:int):
-        page = self.parser.extract_webpage(url)
+    def fetch_once(self, url: str):
+        '''
+        one request to `url`, a request slot of its host must be acquired and is released here
+        only the HTTP round trip is reported as latency, parsing runs after the slot is given back
+        '''
+        try:
+            response = self.parser.fetch(url, timeout=self.scheduler.timeout(url))
+        except Exception as e:
+            retryable, retry_after = self.scheduler.classify(e)
+            if retryable:
+                self.scheduler.failure(url, retry_after)
+            else:
+                # the host answered (e.g. 404) or the request never went out, nothing to back off from,
+                # an error page says little about how fast the host serves pages
+                self.scheduler.release(url)
+            raise
+        self.scheduler.success(url, response.elapsed.total_seconds())
+        return self.parser.parse_webpage(url, response)
+
+    def fetch(self, url: str):
+        '''
+        fetch `url` through the host scheduler, retrying timeouts, connection errors, 429 and 5xx
+        blocks while the host is at its limit or backing off
+        '''
+        for attempt in range(self.max_retries+1):
+            self.scheduler.acquire(url)
+            try:
+                return self.fetch_once(url)
+            except Exception as e:
+                # the backoff delays every request to this host, including our own retry
+                if attempt == self.max_retries or not self.scheduler.classify(e)[0]:
+                    raise
+
+    def crawl(self,url:str):
+        '''
+        fetch `url`, `url_queue.get` already acquired a request slot of its host
+        '''
+        # reserve before fetching, so max_pages is never exceeded and no
+        # request is wasted on a page that would be dropped afterwards,
+        # a retried url still holds the slot of its first attempt
+        if url not in self.attempts and not self.reserve_slot(url):
+            self.scheduler.release(url)
+            return
+        try:
+            page = self.fetch_once(url)
+        except Exception as e:
+            attempt = self.attempts.pop(url, 0)+1
+            if attempt <= self.max_retries and self.scheduler.classify(e)[0]:
+                # back on its host's queue, handed out again once the host's backoff has passed
+                self.attempts[url] = attempt
+                self.url_queue.put(url)
+                return
+            # give the slot back so another url can take it
+            self.release_slot()
+            tqdm.write(f"WARNING: failed to retrieve {url}: {e}")
+            return
+        self.attempts.pop(url, None)
         title, last_modified, links, original_page,size = page["title"], page[
             "last_modified"], page["links"], page["original_page"],page["size"]
 
-        with self.lock:
-            num_crawled=len(self.pages)
-            self.page_to_id[url] = num_crawled
-            page_id = num_crawled
-            self.pages.append(Page(
-                id=num_crawled,
-                title=title,
-                url=url,
-                last_modified=last_modified,
-                links=links,
-                children_id=[],
-                parents_id=[],
-                text=original_page,
-                pagerank=-1.0,
-                size=size,
-                freq_words={}
-            ))
-            if parent_id is not None:
-                self.pages[page_id].parents_id.append(parent_id)
-                self.pages[parent_id].children_id.append(page_id)
-                self.connectivity_matrix[parent_id, page_id] = 1
-            for link in links:
-                if link not in self.page_to_id:
-                    self.url_queue.put((link, page_id))
-                else:
-                    next_page_id = self.page_to_id[link]
-                    self.pages[page_id].children_id.append(next_page_id)
-                    self.pages[next_page_id].parents_id.append(page_id)
-            self.bar.set_description(f"{url}")
-            self.bar.update()
+        # next() on itertools.count is atomic under the GIL, ids stay dense
+        # because only successfully fetched pages reach this point
+        page_id = next(self.id_counter)
+        self.pages[page_id] = Page(
+            id=page_id,
+            title=title,
+            url=url,
+            last_modified=last_modified,
+            links=links,
+            children_id=[],
+            parents_id=[],
+            text=original_page,
+            pagerank=-1.0,
+            size=size,
+            freq_words={}
+        )
+        self.page_to_id[url] = page_id
+        for link in links:
+            if self.claim_url(link):
+                self.url_queue.put(link)
+        if self.on_page is not None:
+            self.on_page(self.pages[page_id])
+        self.bar.set_description(f"{url}")
+        self.bar.update()
 
     def worker(self):
-        while self.url_queue.unfinished_tasks>0:
+        while True:
+            url = self.url_queue.get()
+            if url is None:
+                # sentinel put by `crawl_and_pagerank` once the queue is drained
+                self.url_queue.task_done()
+                return
             try:
-                url,parent_id = self.url_queue.get(timeout=1)
-                self.crawl(url,parent_id)
+                self.crawl(url)
+            finally:
                 self.url_queue.task_done()
-            except:
-                continue
+
+    @staticmethod
+    def link_pages(pages: List[Page], page_to_id: dict) -> np.ndarray:
+        '''
+        fill `children_id` and `parents_id` of every page from its links,
+        returns the connectivity matrix of crawled pages
+        '''
+        connectivity_matrix = np.zeros((len(pages), len(pages)))
+        for page in pages:
+            page.children_id, page.parents_id = [], []
+        for page in pages:
+            for link in page.links:
+                child_id = page_to_id.get(link)
+                if child_id is None or child_id in page.children_id:
+                    continue
+                page.children_id.append(child_id)
+                pages[child_id].parents_id.append(page.id)
+                connectivity_matrix[page.id, child_id] = 1
+        return connectivity_matrix
 
     def crawl_and_pagerank(self,num_workers=10) -> Tuple[List[Page], dict, np.ndarray]:
+        self.crawl_all(num_workers)
+        return self.finalize()
+
+    def crawl_all(self,num_workers=10) -> List[Page]:
         # multithreading crawler
         self.bar=tqdm(total=self.max_pages)
-        self.connectivity_matrix = np.zeros((self.max_pages, self.max_pages))
-        self.url_queue.put((self.initial_url,None))
+        self.pages=[None for _ in range(self.max_pages)]
+        self.claim_url(self.initial_url)
+        self.url_queue.put(self.initial_url)
         with ThreadPoolExecutor(max_workers=num_workers) as executor:
             for _ in range(num_workers):
                 executor.submit(self.worker)
+            # every discovered url has been processed, wake the workers up to exit
             self.url_queue.join()
+            for _ in range(num_workers):
+                self.url_queue.put(None)
+        self.bar.close()
         print("Finished!")
-        # pagerank
-        actual_pages=len(self.pages)
-        self.connectivity_matrix=self.connectivity_matrix[:actual_pages,:actual_pages]
-        pagerank = PageRank(0.8).compute(self.connectivity_matrix)
+        self.pages=[p for p in self.pages if p is not None]
+        return self.pages
+
+    def finalize(self) -> Tuple[List[Page], dict, np.ndarray]:
+        '''
+        link the crawled `self.pages`, compute pagerank and dump them
+        '''
+        # link graph is resolved once all pages are known, outside the workers
+        self.connectivity_matrix=self.link_pages(self.pages,self.page_to_id)
+        # pagerank, warm-started from the previous run when there is one
+        previous = self.load_previous_pagerank()
+        if previous is None:
+            pagerank = PageRank(0.8).compute(self.connectivity_matrix)
+        else:
+            pagerank = PageRank(0.8).compute_incremental(self.connectivity_matrix, *previous)
         for page, pr in zip(self.pages, pagerank):
             page.pagerank = pr
         if self.dump_dir is not None:
-            self.dump_pages(self.pages, self.dump_dir)
+            dump_pages(self.pages, self.dump_dir)
         return self.pages, self.page_to_id, self.connectivity_matrix
 
-    @staticmethod
-    def dump_pages(pages: List[Page], dump_dir):
-        if not os.path.exists(dump_dir):
-            os.mkdir(dump_dir)
-        page_text_dir = os.path.join(dump_dir, "original_pages/")
-        page_metadata_path = os.path.join(dump_dir, "metadata.json")
-        if not os.path.exists(page_text_dir):
-            os.mkdir(page_text_dir)
-        metadata = []
-        for p in pages:
-            metadata.append({
-                "id": p.id,
-                "title": p.title,
-                "url": p.url,
-                "last_modified": p.last_modified,
-                "links": p.links,
-                "children_id": p.children_id,
-                "parents_id": p.parents_id,
-                "pagerank": p.pagerank,
-                "size":p.size,
-                "freq_words":p.freq_words
-            })
-            page_text_path = os.path.join(page_text_dir, f"{p.id}.html")
-            with open(page_text_path, "w", encoding="utf-8") as f:
-                f.write(re.sub(r"[\x00-\x1F\x7F]", "", p.text))
-        with open(page_metadata_path, "w") as f:
-            json.dump(metadata, f, indent=2)
+    def load_previous_pagerank(self):
+        '''
+        match pages against `$dump_dir/metadata.json` of the previous run by url
+        returns (previous pagerank with nan for new pages, ids of pages whose inbound links changed)
+        or None if there is no previous run
+        '''
+        if self.dump_dir is None:
+            return None
+        metadata_path = os.path.join(self.dump_dir, "metadata.json")
+        if not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path, "r") as f:
+            metadata = json.load(f)
+        old_url = {doc["id"]: doc["url"] for doc in metadata}
+        old_pages = {doc["url"]: doc for doc in metadata}
+        previous = np.full(len(self.pages), np.nan)
+        changed = set()
+        for page in self.pages:
+            old = old_pages.get(page.url)
+            if old is None:
+                changed.add(page.id)
+                changed.update(page.children_id)
+                continue
+            previous[page.id] = old["pagerank"]
+            old_children = set(old_url[i] for i in old["children_id"])
+            if old_children != set(self.pages[i].url for i in page.children_id):
+                # out-degree changed, every child receives a different share
+                changed.update(page.children_id)
+                changed.update(self.page_to_id[url] for url in old_children if url in self.page_to_id)
+        # children of pages that disappeared lose an inbound link
+        for doc in metadata:
+            if doc["url"] not in self.page_to_id:
+                changed.update(self.page_to_id[old_url[i]] for i in doc["children_id"] if old_url[i] in self.page_to_id)
+        if np.isnan(previous).all():
+            return None
+        return previous, sorted(changed)
@@ -0,0 +1,264 @@
+from crawler import Crawler
+from page import Page
+from typing import List, Tuple
+from multiprocessing import Process
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import threading
+import sqlite3
+import uuid
+import zlib
+import json
+import time
+import os
+
+
+PENDING, IN_PROGRESS, DONE, FAILED = 0, 1, 2, 3
+
+
+def shard_of(url: str, num_shards: int) -> int:
+    # crc32 instead of hash(), str hashes are salted per process
+    return zlib.crc32(urlparse(url).netloc.encode("utf-8")) % num_shards
+
+
+class SQLiteFrontier(object):
+    '''
+    crawl frontier shared by all shard processes through one sqlite file
+    a shard process only talks to the frontier through `add_urls`, `claim`, `complete`, `fail` and `finished`,
+    so it can be replaced by another implementation (e.g. a socket server for several machines)
+    a claimed url is owned by the claiming process for `lease_time` seconds, after that (or once
+    `reset` is called for a dead owner) it is pending again, `complete` and `fail` only take effect
+    with the token of the claim that still holds the url
+    '''
+
+    def __init__(self, path: str, num_shards: int, max_pages: int, lease_time=300.0) -> None:
+        self.path = path
+        self.num_shards = num_shards
+        self.max_pages = max_pages
+        self.lease_time = lease_time
+        self.local = threading.local()
+
+    def __getstate__(self):
+        # connections are per thread and per process, only ship the settings
+        return {"path": self.path, "num_shards": self.num_shards, "max_pages": self.max_pages,
+                "lease_time": self.lease_time}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def connection(self) -> sqlite3.Connection:
+        if not hasattr(self.local, "conn"):
+            self.local.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self.local.conn.execute("PRAGMA journal_mode=WAL")
+        return self.local.conn
+
+    def close(self):
+        if hasattr(self.local, "conn"):
+            self.local.conn.close()
+            del self.local.conn
+
+    def setup(self, initial_url: str):
+        for path in (self.path, self.path+"-wal", self.path+"-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        conn = self.connection()
+        conn.executescript("""
+            CREATE TABLE urls (url TEXT PRIMARY KEY, shard INTEGER, state INTEGER, owner INTEGER, token TEXT, lease REAL);
+            CREATE INDEX urls_shard_state ON urls (shard, state);
+            CREATE TABLE pages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT, title TEXT,
+                last_modified TEXT, links TEXT, text TEXT, size INTEGER
+            );
+        """)
+        self.add_urls([initial_url])
+        # a connection must not be shared with forked shard processes
+        self.close()
+
+    def add_urls(self, urls: List[str], conn: sqlite3.Connection = None):
+        conn = conn if conn is not None else self.connection()
+        # a url is owned by the shard of its host, handing it over is just inserting it
+        conn.executemany(
+            "INSERT OR IGNORE INTO urls (url, shard, state) VALUES (?, ?, ?)",
+            [(url, shard_of(url, self.num_shards), PENDING) for url in urls]
+        )
+
+    def claim(self, shard: int):
+        '''
+        returns (url, token) of the next pending url of `shard` and marks it in progress,
+        None if there is none or `max_pages` fetches are already done or running
+        '''
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # claims of a shard that hung or died without `reset` run out eventually
+            conn.execute("UPDATE urls SET state = ?, owner = NULL, token = NULL WHERE state = ? AND lease < ?",
+                         (PENDING, IN_PROGRESS, time.time()))
+            reserved, = conn.execute(
+                "SELECT COUNT(*) FROM urls WHERE state IN (?, ?)", (IN_PROGRESS, DONE)).fetchone()
+            row = None
+            if reserved < self.max_pages:
+                row = conn.execute(
+                    "SELECT url FROM urls WHERE shard = ? AND state = ? ORDER BY rowid LIMIT 1",
+                    (shard, PENDING)).fetchone()
+            token = None
+            if row is not None:
+                token = uuid.uuid4().hex
+                conn.execute("UPDATE urls SET state = ?, owner = ?, token = ?, lease = ? WHERE url = ?",
+                             (IN_PROGRESS, os.getpid(), token, time.time()+self.lease_time, row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return None if row is None else (row[0], token)
+
+    def complete(self, url: str, token: str, page: dict) -> bool:
+        '''
+        store the fetched page, returns False (and stores nothing) if the claim was lost to an expired lease
+        '''
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            updated = conn.execute("UPDATE urls SET state = ? WHERE url = ? AND state = ? AND token = ?",
+                                   (DONE, url, IN_PROGRESS, token)).rowcount
+            if updated > 0:
+                conn.execute(
+                    "INSERT INTO pages (url, title, last_modified, links, text, size) VALUES (?, ?, ?, ?, ?, ?)",
+                    (url, page["title"], page["last_modified"], json.dumps(page["links"]), page["original_page"], page["size"]))
+                self.add_urls(page["links"], conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return updated > 0
+
+    def fail(self, url: str, token: str):
+        # the slot is released, another url can be claimed in its place
+        self.connection().execute("UPDATE urls SET state = ? WHERE url = ? AND state = ? AND token = ?",
+                                  (FAILED, url, IN_PROGRESS, token))
+
+    def reset(self, owner: int):
+        '''
+        put the urls claimed by process `owner` back to pending, called once it is known to be dead
+        '''
+        self.connection().execute("UPDATE urls SET state = ?, owner = NULL, token = NULL WHERE state = ? AND owner = ?",
+                                  (PENDING, IN_PROGRESS, owner))
+
+    def finished(self) -> bool:
+        '''
+        True once nothing is in progress and nothing pending can be claimed anymore
+        '''
+        pending, in_progress, done = self.connection().execute(
+            "SELECT COALESCE(SUM(state = ?), 0), COALESCE(SUM(state = ?), 0), COALESCE(SUM(state = ?), 0) FROM urls",
+            (PENDING, IN_PROGRESS, DONE)).fetchone()
+        return in_progress == 0 and (pending == 0 or done >= self.max_pages)
+
+    def pages(self):
+        '''
+        returns all fetched pages in the order they were completed
+        '''
+        return self.connection().execute(
+            "SELECT url, title, last_modified, links, text, size FROM pages ORDER BY seq").fetchall()
+
+
+def crawl_shard(frontier: SQLiteFrontier, shard: int, num_threads: int, poll_interval=0.2):
+    '''
+    entry point of one shard process, fetches the urls whose host hashes to `shard`
+    '''
+    # reuses the fetch logic (host scheduler, retries) of the single process crawler,
+    # hosts never span shards so per-host state stays local to the process
+    crawler = Crawler(None, frontier.max_pages, None)
+
+    def worker():
+        while True:
+            claim = frontier.claim(shard)
+            if claim is None:
+                # other shards may still hand over urls, wait until the whole crawl is idle
+                if frontier.finished():
+                    return
+                time.sleep(poll_interval)
+                continue
+            url, token = claim
+            try:
+                page = crawler.fetch(url)
+            except Exception as e:
+                print(f"WARNING: failed to retrieve {url}: {e}")
+                frontier.fail(url, token)
+                continue
+            try:
+                if not frontier.complete(url, token, page):
+                    # the lease ran out during the fetch, the url was claimed again
+                    print(f"WARNING: lost the claim on {url}, dropping the fetched page")
+            except Exception as e:
+                # a url left in progress would keep every shard waiting for it
+                print(f"WARNING: failed to store {url}: {e}")
+                frontier.fail(url, token)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        futures = [executor.submit(worker) for _ in range(num_threads)]
+        for future in futures:
+            # surface frontier errors instead of losing the thread silently
+            future.result()
+
+
+class DistributedCrawler(Crawler):
+    '''
+    crawler partitioned by host over `num_shards` processes sharing a `SQLiteFrontier`
+    global page ids are assigned when the shards are merged, the output has the same format as `Crawler`
+    '''
+
+    def __init__(self, initial_url, max_pages=300, dump_dir="page_data", num_shards=4, frontier=None) -> None:
+        super().__init__(initial_url, max_pages, dump_dir)
+        self.num_shards = num_shards
+        if frontier is None:
+            frontier_dir = dump_dir if dump_dir is not None else "."
+            frontier = SQLiteFrontier(os.path.join(frontier_dir, "frontier.db"), num_shards, max_pages)
+        self.frontier = frontier
+
+    def crawl_and_pagerank(self, num_workers=10, poll_interval=0.5) -> Tuple[List[Page], dict, np.ndarray]:
+        '''
+        `num_workers` threads are spread over the shard processes
+        raises RuntimeError if a shard process dies, the other shards are stopped
+        '''
+        if self.dump_dir is not None and not os.path.exists(self.dump_dir):
+            os.mkdir(self.dump_dir)
+        self.frontier.setup(self.initial_url)
+        num_threads = max(1, num_workers//self.num_shards)
+        processes = [Process(target=crawl_shard, args=(self.frontier, shard, num_threads))
+                     for shard in range(self.num_shards)]
+        for p in processes:
+            p.start()
+        try:
+            while True:
+                for shard, p in enumerate(processes):
+                    if p.exitcode not in (None, 0):
+                        # its claims would stay in progress and keep the other shards waiting
+                        self.frontier.reset(p.pid)
+                        raise RuntimeError(f"crawl shard {shard} exited with code {p.exitcode}")
+                if all(p.exitcode == 0 for p in processes):
+                    break
+                time.sleep(poll_interval)
+        finally:
+            for p in processes:
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+        print("Finished!")
+        # merge: global ids follow the order pages were completed across all shards
+        self.pages, self.page_to_id = [], {}
+        for page_id, (url, title, last_modified, links, text, size) in enumerate(self.frontier.pages()):
+            self.page_to_id[url] = page_id
+            self.pages.append(Page(
+                id=page_id,
+                title=title,
+                url=url,
+                last_modified=last_modified,
+                links=json.loads(links),
+                children_id=[],
+                parents_id=[],
+                text=text,
+                pagerank=-1.0,
+                size=size,
+                freq_words={}
+            ))
+        return self.finalize()
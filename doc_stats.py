@@ -0,0 +1,63 @@
+from collections import Counter
+from typing import List
+import heapq
+import json
+import math
+
+
+def compute_doc_stats(doc_id: int, title: List[int], body: List[int], k=5):
+    '''
+    returns (stats, top_k) for one document given the word_ids of its stemmed title and body
+    stats is one row of `doc_stats.json`, top_k is [(word_id, count)] of the k most frequent words in title and body
+    '''
+    title_counter = Counter(title)
+    body_counter = Counter(body)
+    all_counter = Counter(title)
+    all_counter.update(body)
+    # same order as a full descending sort, ties keep first-occurrence order
+    top_k = heapq.nlargest(k, all_counter.items(), key=lambda item: item[1])
+    stats = {
+        "id": doc_id,
+        "title_length": len(title),
+        "body_length": len(body),
+        "title_distinct": len(title_counter),
+        "body_distinct": len(body_counter),
+        "max_title_tf": max(title_counter.values(), default=0),
+        "max_body_tf": max(body_counter.values(), default=0),
+    }
+    return stats, top_k
+
+
+def idf(total_docs: int, doc_freq: int) -> float:
+    return math.log((total_docs + 1) / (doc_freq + 1))
+
+
+def tfidf_weight(count: int, max_tf: int, term_idf: float) -> float:
+    return round(count / max(1, max_tf) * term_idf, 4)
+
+
+def add_magnitudes(doc_stats: List[dict], inverted_index: List[dict], field: str):
+    '''
+    store the tf-idf vector length of every document as `$field_magnitude`
+    `inverted_index` is the list written to `$field_inverted_index.json`, `doc_stats` is indexed by doc_id
+    '''
+    total_docs = len(doc_stats)
+    squares = [0.0 for _ in range(total_docs)]
+    for entry in inverted_index:
+        if len(entry["doc"]) <= 0:
+            continue
+        term_idf = idf(total_docs, len(entry["doc"]))
+        for doc_id, count, _ in entry["doc"]:
+            squares[doc_id] += tfidf_weight(count, doc_stats[doc_id][f"max_{field}_tf"], term_idf) ** 2
+    for stats, square in zip(doc_stats, squares):
+        stats[f"{field}_magnitude"] = round(math.sqrt(square), 4)
+
+
+def load_doc_stats(file_path):
+    with open(file_path) as f:
+        return json.load(f)
+
+
+def dump_doc_stats(doc_stats: List[dict], file_path):
+    with open(file_path, "w") as f:
+        json.dump(doc_stats, f)
@@ -0,0 +1,230 @@
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+import random
+import threading
+import time
+
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class HostState(object):
+    def __init__(self, limit: float) -> None:
+        self.limit = limit  # allowed concurrent requests, float so it can grow by fractions
+        self.in_flight = 0
+        self.next_time = 0.0  # earliest time the next request may start
+        self.latency = None  # moving average of successful response time
+        self.min_latency = None  # aged minimum, the baseline responses are compared against
+        self.failures = 0  # consecutive failures, drives the backoff
+        self.last_decrease = 0.0
+
+    def decrease(self):
+        # at most once per round trip, responses of the same window report the same congestion
+        now = time.monotonic()
+        if now-self.last_decrease >= (self.latency or 0.0):
+            self.limit = max(1.0, self.limit/2)
+            self.last_decrease = now
+
+    def wait_time(self, now: float):
+        '''
+        seconds until a request may start, None while the host is at its concurrency limit
+        '''
+        if self.in_flight >= int(self.limit):
+            return None
+        return max(0.0, self.next_time-now)
+
+
+class HostScheduler(object):
+    '''
+    per-host concurrency control for the crawler
+    every host starts at `initial_limit` concurrent requests, the limit grows by one per window of
+    fast successful responses (additive increase) and is halved on errors, 429/503 or responses much
+    slower than the recent fastest one (multiplicative decrease), the fastest response ages by
+    `baseline_growth` per response so a single cached or tiny page doesn't cap the host for good
+    requests to one host are spaced at least `min_delay` seconds apart, failures push the host back
+    by an exponential backoff with full jitter, honouring Retry-After up to `max_retry_after`
+    '''
+
+    def __init__(self, initial_limit=4, max_limit=32, min_delay=0.0, slow_factor=3.0, baseline_growth=1.05,
+                 base_backoff=0.5, max_backoff=30.0, max_retry_after=60.0, min_timeout=2.0, max_timeout=10.0) -> None:
+        self.initial_limit = initial_limit
+        self.max_limit = max_limit
+        self.min_delay = min_delay
+        self.slow_factor = slow_factor
+        self.baseline_growth = baseline_growth
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.hosts = {}
+        self.cond = threading.Condition()
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlparse(url).netloc
+
+    def state(self, host: str) -> HostState:
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.initial_limit)
+        return self.hosts[host]
+
+    def start(self, state: HostState):
+        # caller holds `cond` and checked `state.wait_time`
+        state.in_flight += 1
+        state.next_time = time.monotonic()+self.min_delay
+
+    def acquire(self, url: str):
+        '''
+        block until a request to the host of `url` is allowed
+        '''
+        with self.cond:
+            state = self.state(self.host_of(url))
+            while True:
+                wait = state.wait_time(time.monotonic())
+                if wait == 0:
+                    break
+                self.cond.wait(timeout=wait)
+            self.start(state)
+
+    def release(self, url: str):
+        '''
+        give back a request slot that was not used or whose response says nothing about the host's load
+        '''
+        with self.cond:
+            self.state(self.host_of(url)).in_flight -= 1
+            self.cond.notify_all()
+
+    def timeout(self, url: str) -> float:
+        '''
+        request timeout derived from the host's observed latency
+        '''
+        with self.cond:
+            latency = self.state(self.host_of(url)).latency
+        if latency is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, 4*latency))
+
+    def backoff(self, failures: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.base_backoff*2**failures))
+
+    def success(self, url: str, latency: float):
+        with self.cond:
+            state = self.state(self.host_of(url))
+            state.in_flight -= 1
+            state.failures = 0
+            state.latency = latency if state.latency is None else 0.8*state.latency+0.2*latency
+            state.min_latency = latency if state.min_latency is None else min(state.min_latency*self.baseline_growth, latency)
+            if latency > self.slow_factor*state.min_latency:
+                # the host is queueing our requests, back off before it starts failing
+                state.decrease()
+            else:
+                state.limit = min(self.max_limit, state.limit+1/state.limit)
+            self.cond.notify_all()
+
+    def failure(self, url: str, retry_after: float = None):
+        with self.cond:
+            state = self.state(self.host_of(url))
+            state.in_flight -= 1
+            state.failures += 1
+            state.decrease()
+            delay = self.backoff(state.failures)
+            if retry_after is not None:
+                # a misbehaving server must not park the host for hours
+                delay = max(delay, min(retry_after, self.max_retry_after))
+            state.next_time = max(state.next_time, time.monotonic()+delay)
+            self.cond.notify_all()
+
+    @staticmethod
+    def parse_retry_after(value: str):
+        '''
+        Retry-After is either delay-seconds or an HTTP-date, returns seconds or None
+        '''
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        return max(0.0, (date-datetime.now(timezone.utc)).total_seconds())
+
+    @staticmethod
+    def classify(error: Exception):
+        '''
+        returns (whether the request is worth retrying, Retry-After in seconds or None)
+        '''
+        # the failed request already imported requests, the stages that never fetch don't
+        import requests
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            retry_after = HostScheduler.parse_retry_after(error.response.headers.get("Retry-After"))
+            return error.response.status_code in RETRYABLE_STATUS, retry_after
+        return isinstance(error, (requests.ConnectionError, requests.Timeout)), None
+
+
+class HostQueue(object):
+    '''
+    url queue with one ready queue per host, `get` only hands out a url whose host has capacity
+    in the scheduler, so workers never wait on a throttled host while urls of other hosts are ready
+    same interface as `queue.Queue` for the crawler (put, get, task_done, join), None is a sentinel
+    '''
+
+    def __init__(self, scheduler: HostScheduler) -> None:
+        self.scheduler = scheduler
+        # shared with the scheduler, a finished request wakes up the workers waiting for capacity
+        self.cond = scheduler.cond
+        self.ready = {}  # host -> deque of urls, in the order hosts are served
+        self.sentinels = 0
+        self.unfinished = 0
+
+    def put(self, url: str):
+        with self.cond:
+            if url is None:
+                self.sentinels += 1
+            else:
+                self.ready.setdefault(self.scheduler.host_of(url), deque()).append(url)
+            self.unfinished += 1
+            self.cond.notify_all()
+
+    def get(self):
+        '''
+        block until a url can be fetched and return it with a request slot of its host acquired
+        '''
+        with self.cond:
+            while True:
+                if self.sentinels > 0:
+                    self.sentinels -= 1
+                    return None
+                now = time.monotonic()
+                timeout = None
+                for host in self.ready:
+                    state = self.scheduler.state(host)
+                    wait = state.wait_time(now)
+                    if wait == 0:
+                        urls = self.ready.pop(host)
+                        url = urls.popleft()
+                        if urls:
+                            # round robin, the host goes to the back of the line
+                            self.ready[host] = urls
+                        self.scheduler.start(state)
+                        return url
+                    if wait is not None:
+                        timeout = wait if timeout is None else min(timeout, wait)
+                self.cond.wait(timeout=timeout)
+
+    def task_done(self):
+        with self.cond:
+            self.unfinished -= 1
+            if self.unfinished == 0:
+                self.cond.notify_all()
+
+    def join(self):
+        with self.cond:
+            while self.unfinished > 0:
+                self.cond.wait()
@@ -1,45 +1,85 @@
-from crawler import Crawler
-from stemmer import Stemmer
-from page_parser import PageParser
 import os
+import sys
 import json
-from tqdm import tqdm
 from typing import List
-from page import Page
+from page import Page, dump_pages
+
+# heavy dependencies (bs4, numpy, requests, tqdm, wordninja) are imported
+# inside the stage that needs them, so running a single stage stays cheap
 
 
 INITIAL_URL = "https://www.cse.ust.hk/~kwtleung/COMP4321/testpage.htm"
 PAGE_DIR = "page_data"
+STAGES = ["crawl", "stemming", "index"]
 
 
-def main():
-    pages, page_to_id, connectivity_matrix = crawl_pages(num_workers=50)
-    forward_index, vocabulary = stemming()
-    title_inverted_index, body_inverted_index = build_inverted_index()
+def main(stages: List[str] = STAGES):
+    '''
+    run the given stages, always in the order crawl, stemming, index, e.g. `python main.py stemming index`
+    `python main.py stream` runs all three stages concurrently instead
+    '''
+    if stages == ["stream"]:
+        streaming(num_workers=50)
+        return
+    for stage in stages:
+        assert stage in STAGES, f"unknown stage {stage}, expected one of {STAGES}"
+    if "crawl" in stages:
+        pages, page_to_id, connectivity_matrix = crawl_pages(num_workers=50)
+    if "stemming" in stages:
+        forward_index, vocabulary = stemming()
+    if "index" in stages:
+        title_inverted_index, body_inverted_index = build_inverted_index()
 
 
-def crawl_pages(num_workers:int):
+def crawl_pages(num_workers:int, num_shards:int=1):
     '''
     crawl pages and save to `$PAGE_DIR/original_pages/$doc_id.html`
     also save the metadata `$PAGE_DIR/metadata.json`
+    with `num_shards` > 1 hosts are partitioned over that many processes
     '''
-    crawler = Crawler(INITIAL_URL,300,PAGE_DIR)
+    if num_shards > 1:
+        from distributed_crawler import DistributedCrawler
+        crawler = DistributedCrawler(INITIAL_URL,300,PAGE_DIR,num_shards)
+    else:
+        from crawler import Crawler
+        crawler = Crawler(INITIAL_URL,300,PAGE_DIR)
     return crawler.crawl_and_pagerank(num_workers=num_workers)
 
 
+def streaming(num_workers:int):
+    '''
+    crawl, stem and index at the same time, fetched pages are stemmed and indexed while the crawl goes on
+    writes the same files as `crawl_pages`, `stemming` and `build_inverted_index`
+    '''
+    from crawler import Crawler
+    from pipeline import StreamingPipeline
+    crawler = Crawler(INITIAL_URL,300,PAGE_DIR)
+    return StreamingPipeline(crawler, PAGE_DIR).run(num_workers=num_workers)
+
+
 def stemming():
     '''
     perform stopword removal & stemming on page title and body
     save stemmed results (forward index) to `$PAGE_DIR/forward_index.json`
     save dictionary (word->word_id) to `$PAGE_DIR/dictionary.json`
+    and its memory-mappable form to `$PAGE_DIR/dictionary.bin`
+    the stemmer's caches are kept in `$PAGE_DIR/stemmer_state.pkl` for the next run
+    save per-document statistics (lengths, distinct words, max tf) to `$PAGE_DIR/doc_stats.json`
     '''
+    from doc_stats import compute_doc_stats, dump_doc_stats
+    from page_parser import PageParser
+    from stemmer import Stemmer
+    from tqdm import tqdm
+    from vocabulary import CompactVocabulary
     parser = PageParser()
-    stemmer = Stemmer("stopwords.txt")
+    stemmer_state_path = os.path.join(PAGE_DIR, "stemmer_state.pkl")
+    stemmer = Stemmer("stopwords.txt", state_file=stemmer_state_path)
     html_dir = os.path.join(PAGE_DIR, "original_pages/")
     metadata_path=os.path.join(PAGE_DIR,"metadata.json")
     with open(metadata_path,"r") as f:
         metadata=json.load(f)
     pages=[None for _ in range(len(metadata))]
+    doc_stats=[None for _ in range(len(metadata))]
     forward_index = []
     # stemming, build forward index
     for file in tqdm(os.listdir(html_dir), desc="stemming..."):
@@ -53,13 +93,10 @@ def stemming():
         pages[doc_id].title=title
         stemmed_title,stemmed_word_index_title = stemmer.stem_and_map(title)
         stemmed_body,stemmed_word_index_body = stemmer.stem_and_map(body)
-        all_words=stemmed_title+stemmed_body
-        freq_counter={}
-        for w in all_words:
-            stemmed_word=stemmer.vocabulary().invert_dictionary()[w]
-            freq_counter[stemmed_word]=1 if stemmed_word not in freq_counter else freq_counter[stemmed_word]+1
-        freq_words = dict(sorted(freq_counter.items(), key=lambda item: item[1], reverse=True)[:min(5,len(freq_counter))])
-        pages[doc_id].freq_words=freq_words
+        stats, top_words = compute_doc_stats(doc_id, stemmed_title, stemmed_body, k=5)
+        invert_vocab = stemmer.vocabulary().invert_dictionary()
+        pages[doc_id].freq_words={invert_vocab[w]: count for w, count in top_words}
+        doc_stats[doc_id]=stats
         forward_index.append({
             "id": doc_id,
             "title": stemmed_title,
@@ -67,17 +104,25 @@ def stemming():
             "body": stemmed_body,
             "body_word_pos":stemmed_word_index_body,
         })
-    Crawler.dump_pages(pages,PAGE_DIR)
+    dump_pages(pages,PAGE_DIR)
     forward_index.sort(key=lambda x: x["id"])
     forward_index_path = os.path.join(PAGE_DIR, "forward_index.json")
     with open(forward_index_path, "w", encoding="utf-8") as f:
         json.dump(forward_index, f)
     with open(os.path.join(PAGE_DIR, "dictionary.json"), "w") as f:
         json.dump(stemmer.vocabulary().dictionary(), f)
+    CompactVocabulary.from_json(os.path.join(PAGE_DIR, "dictionary.json"), os.path.join(PAGE_DIR, "dictionary.bin"))
+    stemmer.save_state(stemmer_state_path)
+    dump_doc_stats(doc_stats, os.path.join(PAGE_DIR, "doc_stats.json"))
     return forward_index, stemmer.vocabulary()
 
 
 def build_inverted_index():
+    '''
+    build title and body inverted index from the forward index
+    also complete `$PAGE_DIR/doc_stats.json` with the tf-idf magnitude of every page
+    '''
+    from doc_stats import add_magnitudes, dump_doc_stats, load_doc_stats
     forward_index_path = os.path.join(PAGE_DIR, "forward_index.json")
     dictionary_path = os.path.join(PAGE_DIR, "dictionary.json")
     with open(dictionary_path, "r") as f:
@@ -109,8 +154,14 @@ def build_inverted_index():
     with open(body_inverted_index_path, "w") as f:
         json.dump(body_inverted_index, f)
 
+    doc_stats_path = os.path.join(PAGE_DIR, "doc_stats.json")
+    doc_stats = load_doc_stats(doc_stats_path)
+    add_magnitudes(doc_stats, title_inverted_index, "title")
+    add_magnitudes(doc_stats, body_inverted_index, "body")
+    dump_doc_stats(doc_stats, doc_stats_path)
+
     return title_inverted_index, body_inverted_index
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:] or STAGES)
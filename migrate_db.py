@@ -1,8 +1,11 @@
 from collections import defaultdict
 import json
 import math
+import os
 import psycopg2
 from psycopg2.extras import execute_batch, Json
+from vocabulary import CompactVocabulary
+from doc_stats import idf, load_doc_stats, tfidf_weight
 
 DB_CONFIG = {
     "host": "localhost",
@@ -12,8 +15,20 @@ DB_CONFIG = {
     "password": "test123",
 }
 
+# number of highest impact documents kept per term as its champion list
+CHAMPION_SIZE = 50
+# share of the normalized pagerank blended into a posting's impact, 0 orders by tf-idf only
+PAGERANK_WEIGHT = 0.0
+
 
 def load_dictionary(file_path, stopwords_file="stopwords.txt"):
+    # the memory-mapped dictionary written next to the json loads without parsing,
+    # unless the json changed since it was built
+    compact_path = os.path.splitext(file_path)[0] + ".bin"
+    if os.path.exists(compact_path) and (
+            not os.path.exists(file_path) or CompactVocabulary.is_current(compact_path, file_path)):
+        return CompactVocabulary.load(compact_path).invert_dictionary()
+
     with open(file_path) as f:
         data = json.load(f)
 
@@ -47,7 +62,7 @@ def transform_index_data(index_file, term_mapping):
     return transformed
 
 
-def transform_index_data_with_tfidf(index_data, tfidf_vectors, magnitudes):
+def transform_index_data_with_tfidf(index_data, idf_dict, max_tf_dict, magnitudes):
     transformed = []
     for entry in index_data:
         term_id = entry[0]
@@ -55,7 +70,7 @@ def transform_index_data_with_tfidf(index_data, tfidf_vectors, magnitudes):
         documents = {}
         for doc in entry[2]:
             doc_id = doc["id"]
-            tfidf = tfidf_vectors.get(doc_id, {}).get(term_id, 0.0)
+            tfidf = tfidf_weight(doc["count"], max_tf_dict.get(doc_id, 0), idf_dict[term_id])
             mag = magnitudes.get(doc_id, 0)
             tfidfM = tfidf / mag if mag != 0 else 0.0
             if tfidfM == 0:
@@ -202,35 +217,59 @@ def calculate_max_tf(index_data):
     return max_tf_dict
 
 
-def calculate_tfidf_vectors(index_data, total_docs, max_tf_dict):
-    term_doc_freq = {}
-    for entry in index_data:
-        term_id = entry[0]
-        doc_count = len(entry[2])
-        term_doc_freq[term_id] = doc_count
+def calculate_idf(index_data, total_docs):
+    return {entry[0]: idf(total_docs, len(entry[2])) for entry in index_data}
 
-    idf_cache = {
-        term_id: math.log((total_docs + 1) / (doc_freq + 1))
-        for term_id, doc_freq in term_doc_freq.items()
-    }
 
-    doc_vectors = defaultdict(dict)
+def calculate_magnitudes(index_data, idf_dict, max_tf_dict):
+    squares = defaultdict(float)
     for entry in index_data:
         term_id, term, docs = entry
         for doc in docs:
             doc_id = doc["id"]
-            tf = doc["count"] / max(1, max_tf_dict.get(doc_id, 0))
-            tfidf = tf * idf_cache[term_id]
-            doc_vectors[doc_id][term_id] = round(tfidf, 4)
-
-    return doc_vectors
-
-
-def cal_mangitude(vector):
-    sum = 0
-    for v in vector.values():
-        sum += v**2
-    return round(math.sqrt(sum), 4)
+            squares[doc_id] += tfidf_weight(doc["count"], max_tf_dict.get(doc_id, 0), idf_dict[term_id]) ** 2
+    return {doc_id: round(math.sqrt(square), 4) for doc_id, square in squares.items()}
+
+
+def doc_stats_to_dicts(doc_stats):
+    """
+    returns max_title_tf, max_body_tf, title_magnitude and body_magnitude dicts,
+    keyed by the doc_ids that have at least one title (resp. body) word
+    the magnitude dicts are None when the index stage has not added them yet
+    """
+    dicts = [{}, {}, {}, {}]
+    for stats in doc_stats:
+        for field, max_tf, mag in (("title", dicts[0], dicts[2]), ("body", dicts[1], dicts[3])):
+            if stats[f"{field}_length"] > 0:
+                max_tf[stats["id"]] = stats[f"max_{field}_tf"]
+                mag[stats["id"]] = stats.get(f"{field}_magnitude")
+    for i in (2, 3):
+        if None in dicts[i].values():
+            dicts[i] = None
+    return dicts
+
+
+def impact_ordered_postings(documents, page_rank_dict, pagerank_weight=PAGERANK_WEIGHT, champion_size=CHAMPION_SIZE):
+    """
+    returns (postings, champions) for one term's {doc_id: tfidf} map
+    postings is every [doc_id, tfidf] sorted by impact, champions is the top `champion_size` of them,
+    impact is the tfidf blended with the document's pagerank normalized to [0, 1]
+    """
+    def impact(item):
+        doc_id, weight = item
+        return (1 - pagerank_weight) * weight + pagerank_weight * page_rank_dict.get(doc_id, 0.0), -doc_id
+
+    postings = [[doc_id, weight] for doc_id, weight in sorted(documents.items(), key=impact, reverse=True)]
+    return postings, postings[:champion_size]
+
+
+def add_impact_columns(cursor):
+    for table in ("title_inverted_index", "body_inverted_index"):
+        cursor.execute(
+            f"""ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS impact_postings JSONB,
+                ADD COLUMN IF NOT EXISTS champions JSONB"""
+        )
 
 
 def main():
@@ -238,29 +277,41 @@ def main():
     title_data = transform_index_data("page_data/title_inverted_index.json", id_to_term)
     body_data = transform_index_data("page_data/body_inverted_index.json", id_to_term)
 
-    max_title_tf_dict = calculate_max_tf(title_data)
-    max_body_tf_dict = calculate_max_tf(body_data)
-
     with open("page_data/metadata.json") as f:
         metadata = json.load(f)
+    total_docs = len(metadata)
+
+    title_idf = calculate_idf(title_data, total_docs)
+    body_idf = calculate_idf(body_data, total_docs)
+
+    # per-document statistics written during stemming and indexing,
+    # scanning the inverted indexes is only needed for older page_data
+    if os.path.exists("page_data/doc_stats.json"):
+        max_title_tf_dict, max_body_tf_dict, title_mags, body_mags = doc_stats_to_dicts(
+            load_doc_stats("page_data/doc_stats.json")
+        )
+        # `python main.py stemming` alone writes doc_stats.json without magnitudes
+        if title_mags is None:
+            title_mags = calculate_magnitudes(title_data, title_idf, max_title_tf_dict)
+        if body_mags is None:
+            body_mags = calculate_magnitudes(body_data, body_idf, max_body_tf_dict)
+    else:
+        max_title_tf_dict = calculate_max_tf(title_data)
+        max_body_tf_dict = calculate_max_tf(body_data)
+        title_mags = calculate_magnitudes(title_data, title_idf, max_title_tf_dict)
+        body_mags = calculate_magnitudes(body_data, body_idf, max_body_tf_dict)
+
     id_to_url = {doc["id"]: doc["url"] for doc in metadata}
     meta_data, max_page_rank = transform_metadata_data(
         "page_data/metadata.json", id_to_url, max_title_tf_dict, max_body_tf_dict
     )
 
-    total_docs = len(meta_data)
-
-    title_tfidf = calculate_tfidf_vectors(title_data, total_docs, max_title_tf_dict)
-
-    body_tfidf = calculate_tfidf_vectors(body_data, total_docs, max_body_tf_dict)
-
-    title_mags = {doc_id: cal_mangitude(vec) for doc_id, vec in title_tfidf.items()}
-    body_mags = {doc_id: cal_mangitude(vec) for doc_id, vec in body_tfidf.items()}
-
     title_data_tfidf = transform_index_data_with_tfidf(
-        title_data, title_tfidf, title_mags
+        title_data, title_idf, max_title_tf_dict, title_mags
+    )
+    body_data_tfidf = transform_index_data_with_tfidf(
+        body_data, body_idf, max_body_tf_dict, body_mags
     )
-    body_data_tfidf = transform_index_data_with_tfidf(body_data, body_tfidf, body_mags)
 
     title_n_gram_data, body_n_gram_data = transform_n_gram_data(
         "page_data/forward_index.json", id_to_term, 4
@@ -272,6 +323,15 @@ def main():
         body_n_gram_data, total_docs, max_body_tf_dict, body_mags
     )
 
+    page_rank_dict = {m[0]: m[10] / max_page_rank for m in meta_data}
+
+    def index_rows(entries):
+        rows = []
+        for term, n, docs in entries:
+            postings, champions = impact_ordered_postings(docs, page_rank_dict)
+            rows.append((term, n, Json(docs), Json(postings), Json(champions)))
+        return rows
+
     conn = psycopg2.connect(**DB_CONFIG)
     cursor = conn.cursor()
 
@@ -285,16 +345,19 @@ def main():
                 document_meta
              CASCADE"""
         )
+        add_impact_columns(cursor)
 
         print("start title_inverted_index migration\n")
         execute_batch(
             cursor,
-            """INSERT INTO title_inverted_index (term, ngram, documents)
-               VALUES (%s, %s, %s::jsonb)
+            """INSERT INTO title_inverted_index (term, ngram, documents, impact_postings, champions)
+               VALUES (%s, %s, %s::jsonb, %s::jsonb, %s::jsonb)
                ON CONFLICT (term) DO UPDATE SET
                    documents = EXCLUDED.documents,
+                   impact_postings = EXCLUDED.impact_postings,
+                   champions = EXCLUDED.champions,
                    updated_at = CURRENT_TIMESTAMP""",
-            [(term, 1, Json(docs)) for id, term, docs in title_data_tfidf],
+            index_rows((term, 1, docs) for id, term, docs in title_data_tfidf),
             page_size=100,
         )
         print("finished title_inverted_index migration\n")
@@ -302,12 +365,14 @@ def main():
         print("start body_inverted_index migration\n")
         execute_batch(
             cursor,
-            """INSERT INTO body_inverted_index (term, ngram, documents)
-               VALUES (%s, %s, %s::jsonb)
+            """INSERT INTO body_inverted_index (term, ngram, documents, impact_postings, champions)
+               VALUES (%s, %s, %s::jsonb, %s::jsonb, %s::jsonb)
                ON CONFLICT (term) DO UPDATE SET
                    documents = EXCLUDED.documents,
+                   impact_postings = EXCLUDED.impact_postings,
+                   champions = EXCLUDED.champions,
                    updated_at = CURRENT_TIMESTAMP""",
-            [(term, 1, Json(docs)) for id, term, docs in body_data_tfidf],
+            index_rows((term, 1, docs) for id, term, docs in body_data_tfidf),
             page_size=100,
         )
         print("finished body_inverted_index migration\n")
@@ -315,12 +380,14 @@ def main():
         print("start title_n_gram_inverted_index migration\n")
         execute_batch(
             cursor,
-            """INSERT INTO title_inverted_index (term, ngram, documents)
-               VALUES (%s, %s, %s::jsonb)
+            """INSERT INTO title_inverted_index (term, ngram, documents, impact_postings, champions)
+               VALUES (%s, %s, %s::jsonb, %s::jsonb, %s::jsonb)
                ON CONFLICT (term) DO UPDATE SET
                    documents = EXCLUDED.documents,
+                   impact_postings = EXCLUDED.impact_postings,
+                   champions = EXCLUDED.champions,
                    updated_at = CURRENT_TIMESTAMP""",
-            [(term, n, Json(docs)) for term, n, docs in title_n_gram_tfidf],
+            index_rows(title_n_gram_tfidf),
             page_size=100,
         )
         print("finished title_n_gram_inverted_index migration\n")
@@ -328,12 +395,14 @@ def main():
         print("start body_n_gram_inverted_index migration\n")
         execute_batch(
             cursor,
-            """INSERT INTO body_inverted_index (term, ngram, documents)
-               VALUES (%s, %s, %s::jsonb)
+            """INSERT INTO body_inverted_index (term, ngram, documents, impact_postings, champions)
+               VALUES (%s, %s, %s::jsonb, %s::jsonb, %s::jsonb)
                ON CONFLICT (term) DO UPDATE SET
                    documents = EXCLUDED.documents,
+                   impact_postings = EXCLUDED.impact_postings,
+                   champions = EXCLUDED.champions,
                    updated_at = CURRENT_TIMESTAMP""",
-            [(term, n, Json(docs)) for term, n, docs in body_n_gram_tfidf],
+            index_rows(body_n_gram_tfidf),
             page_size=100,
         )
         print("finished body_inverted_index migration\n")
@@ -1,5 +1,8 @@
 from dataclasses import dataclass
 from typing import List
+import json
+import os
+import re
 
 
 @dataclass
@@ -34,3 +37,38 @@ class Page:
             freq_words=metadata["freq_words"]
         )
         return page
+
+
+def clean_page_text(text: str) -> str:
+    '''
+    page text as it is stored in `original_pages/`
+    '''
+    return re.sub(r"[\x00-\x1F\x7F]", "", text)
+
+
+def dump_pages(pages: List[Page], dump_dir):
+    if not os.path.exists(dump_dir):
+        os.mkdir(dump_dir)
+    page_text_dir = os.path.join(dump_dir, "original_pages/")
+    page_metadata_path = os.path.join(dump_dir, "metadata.json")
+    if not os.path.exists(page_text_dir):
+        os.mkdir(page_text_dir)
+    metadata = []
+    for p in pages:
+        metadata.append({
+            "id": p.id,
+            "title": p.title,
+            "url": p.url,
+            "last_modified": p.last_modified,
+            "links": p.links,
+            "children_id": p.children_id,
+            "parents_id": p.parents_id,
+            "pagerank": p.pagerank,
+            "size":p.size,
+            "freq_words":p.freq_words
+        })
+        page_text_path = os.path.join(page_text_dir, f"{p.id}.html")
+        with open(page_text_path, "w", encoding="utf-8") as f:
+            f.write(clean_page_text(p.text))
+    with open(page_metadata_path, "w") as f:
+        json.dump(metadata, f, indent=2)
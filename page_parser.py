@@ -1,4 +1,3 @@
-import requests
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
 import re
@@ -22,16 +21,23 @@ class PageParser(object):
         #     last_part.endswith(('.html', '.htm', '.php', '.asp')))
         return True
 
-    def extract_webpage(self, url: str):
+    def fetch(self, url: str, timeout: float = 10):
         '''
-        returns {"title":str,"last_modified":str,"links":List[str],"original_page":str}
+        returns the response of `url`, raises `requests.HTTPError` for error statuses
         '''
-        # try:
-        # extract title and body as string
-        response = requests.get(url, headers=self.headers, timeout=10)
+        # imported here so that stages which only parse stored pages don't pay for it
+        import requests
+        response = requests.get(url, headers=self.headers, timeout=timeout)
         response.encoding = "utf-8"
         response.raise_for_status()
+        return response
 
+    def parse_webpage(self, url: str, response):
+        '''
+        returns {"title":str,"last_modified":str,"links":List[str],"original_page":str} of a fetched page
+        '''
+        # try:
+        # extract title and body as string
         last_modified = response.headers.get('Last-Modified')
         soup = BeautifulSoup(response.text, 'html.parser')
         h1 = soup.find('h1')
@@ -57,6 +63,12 @@ class PageParser(object):
             "size":len(response.text)
         }
 
+    def extract_webpage(self, url: str, timeout: float = 10):
+        '''
+        returns {"title":str,"last_modified":str,"links":List[str],"original_page":str}
+        '''
+        return self.parse_webpage(url, self.fetch(url, timeout))
+
     def extract_title_and_body_from_html_str(self, content: str):
         soup = BeautifulSoup(content, "html.parser",from_encoding="utf-8")
         h1 = soup.find('h1')
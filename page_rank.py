@@ -1,28 +1,138 @@
 import numpy as np
+from typing import List
 
 
 class PageRank(object):
-    def __init__(self, damping_factor=0.8) -> None:
+    def __init__(self, damping_factor=0.8, extrapolate_every=10) -> None:
         self.d = damping_factor
+        # apply an Aitken extrapolation step every `extrapolate_every` iterations, 0 disables it
+        self.extrapolate_every = extrapolate_every
+        # convergence report of the last call
+        self.iterations = 0
+        self.residuals = []
+        self.local_iterations = 0  # rounds of residual push in `compute_incremental`
 
-    def compute(self, connectivity_matrix: np.ndarray, max_iter=1000):
-        M = connectivity_matrix.astype(np.float32).T
-        C = connectivity_matrix.sum(axis=-1,keepdims=True).T
+    @staticmethod
+    def transition_matrix(connectivity_matrix: np.ndarray) -> np.ndarray:
+        M = connectivity_matrix.astype(np.float64).T
+        C = connectivity_matrix.astype(np.float64).sum(axis=-1,keepdims=True).T
         C[C == 0.0] = 1e-5
         M/=C
-        pr_norm = float(M.shape[0])
-        pr = np.ones((M.shape[0],))
-        next_pr = np.zeros_like(pr)
+        return M
 
-        cur_iter = 0
-        while np.abs(pr-next_pr).sum() > 1e-5 and cur_iter < max_iter:
+    @staticmethod
+    def teleport_matrix(num_pages: int, seed_sets: List[List[int]]) -> np.ndarray:
+        '''
+        build a (num_pages, len(seed_sets)) teleport matrix, column k jumps uniformly to the pages in seed_sets[k]
+        an empty seed set gives the uniform (non-personalized) teleport
+        '''
+        V = np.zeros((num_pages, len(seed_sets)), dtype=np.float32)
+        for k, seeds in enumerate(seed_sets):
+            if len(seeds) == 0:
+                V[:, k] = 1.0/num_pages
+            else:
+                V[list(seeds), k] = 1.0/len(seeds)
+        return V
+
+    @staticmethod
+    def aitken(x0: np.ndarray, x1: np.ndarray, x2: np.ndarray) -> np.ndarray:
+        '''
+        component-wise Aitken delta-squared extrapolation of three equally spaced iterates
+        '''
+        denom = x2-2*x1+x0
+        safe = np.abs(denom) > 1e-12
+        x = x2.copy()
+        x[safe] = x2[safe]-(x2[safe]-x1[safe])**2/denom[safe]
+        x[x < 0] = 0.0
+        return x
+
+    def compute_batch(self, connectivity_matrix: np.ndarray, teleport: np.ndarray = None, max_iter=1000, tol=1e-5,
+                      init: np.ndarray = None, transition: np.ndarray = None):
+        '''
+        compute one pagerank vector per column of `teleport` (num_pages, K) with a single matrix product per iteration
+        `init` warm-starts the iteration, either (num_pages,) shared by all columns or (num_pages, K)
+        `transition` is the `transition_matrix` of `connectivity_matrix` when the caller already built it
+        returns a (num_pages, K) array, every column is normalized to sum up to num_pages
+        '''
+        M = transition if transition is not None else self.transition_matrix(connectivity_matrix)
+        n = M.shape[0]
+        if teleport is None:
+            teleport = self.teleport_matrix(n, [[]])
+        V = teleport.astype(np.float64)
+        V = V/V.sum(axis=0, keepdims=True)*n
+        if init is None:
+            pr = np.ones_like(V)
+        else:
+            pr = np.broadcast_to(np.asarray(init, dtype=np.float64).reshape(n, -1), V.shape).copy()
+            pr *= n/pr.sum(axis=0, keepdims=True)
+        # the last 4 iterates, extrapolation uses every other one: pages linking back to a hub
+        # give error modes near -d as well as +d, which alternate in sign between successive iterates
+        history = [pr]
+        self.iterations = 0
+        self.residuals = []
+        while self.iterations < max_iter:
+            next_pr = (1-self.d)*V+self.d*M@pr
+            next_pr *= n/next_pr.sum(axis=0, keepdims=True)
+            self.iterations += 1
+            if self.extrapolate_every > 0 and self.iterations % self.extrapolate_every == 0 and len(history) >= 4:
+                next_pr = self.aitken(history[-4], history[-2], next_pr)
+                next_pr *= n/next_pr.sum(axis=0, keepdims=True)
+            # L1 residual of the slowest converging column
+            residual = float(np.abs(next_pr-pr).sum(axis=0).max())
+            self.residuals.append(residual)
+            history = history[-3:]+[next_pr]
             pr = next_pr
-            next_pr = (1-self.d)+self.d*M@pr.T
-            pr_sum = next_pr.sum()
-            next_pr *= pr_norm/pr_sum
-            cur_iter += 1
+            if residual <= tol:
+                break
         return pr
 
+    def compute(self, connectivity_matrix: np.ndarray, max_iter=1000, init: np.ndarray = None, tol=1e-5,
+                transition: np.ndarray = None):
+        return self.compute_batch(connectivity_matrix, max_iter=max_iter, tol=tol, init=init, transition=transition)[:, 0]
+
+    def compute_incremental(self, connectivity_matrix: np.ndarray, previous: np.ndarray, changed: List[int],
+                            max_iter=1000, tol=1e-5, fallback_fraction=0.3, max_push_sweeps=8):
+        '''
+        update `previous` pagerank after the pages in `changed` gained or lost inbound links (or were added)
+        unknown entries of `previous` (nan) start from the mean value 1.0
+        residual push: only pages holding more than tol/num_pages of unabsorbed residual are updated, each push
+        hands d/outdegree of it to the page's children, so the work follows where the change actually spreads
+        the result is then checked by a warm-started full iteration, which stops after one step when the push converged
+        the push is abandoned for a plain warm-started solve once one round touches more than `fallback_fraction`
+        of the graph's links, or all rounds together more than `max_push_sweeps` times its links:
+        on hub-dominated graphs (the test site links every page to and from its home page) a change reaches
+        everything in one round, so there the update is just a warm start
+        '''
+        M = self.transition_matrix(connectivity_matrix)
+        n = M.shape[0]
+        out_degree = (connectivity_matrix != 0).sum(axis=-1)
+        x = np.asarray(previous, dtype=np.float64).copy()
+        x[np.isnan(x)] = 1.0
+        x *= n/x.sum()
+        # global normalization of the power iteration, rank of dangling pages leaks out of M@x
+        scale = n/((1-self.d)*n+self.d*x[out_degree > 0].sum())
+        # the previous scores are a fixed point everywhere but at the changed rows
+        changed = np.asarray(sorted(changed), dtype=int)
+        residual = np.zeros(n)
+        residual[changed] = scale*((1-self.d)+self.d*M[changed]@x)-x[changed]
+        num_links = out_degree.sum()
+        work = 0
+        self.local_iterations = 0
+        while self.local_iterations < max_iter:
+            idx = np.nonzero(np.abs(residual) > tol/n)[0]
+            if len(idx) == 0:
+                break
+            round_work = out_degree[idx].sum()
+            if round_work > fallback_fraction*num_links or work+round_work > max_push_sweeps*num_links:
+                break
+            work += round_work
+            push = residual[idx]
+            x[idx] += push
+            residual[idx] = 0.0
+            residual += scale*self.d*M[:, idx]@push
+            self.local_iterations += 1
+        return self.compute(connectivity_matrix, max_iter=max_iter, init=x, tol=tol, transition=M)
+
 if __name__=="__main__":
     M=np.array([
         [1,0,1],
@@ -30,4 +140,4 @@ if __name__=="__main__":
         [1,1,0],
     ])
     pr=PageRank(0.8).compute(M)
-    print(pr)
\ No newline at end of file
+    print(pr)
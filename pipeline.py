@@ -0,0 +1,172 @@
+from crawler import Crawler
+from doc_stats import add_magnitudes, compute_doc_stats, dump_doc_stats
+from vocabulary import CompactVocabulary, Vocabulary
+from page import Page, clean_page_text
+from stem_worker import init_stem_worker, stem_document
+from stemmer import Stemmer
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from queue import Queue
+from typing import List
+import threading
+import json
+import os
+
+
+class StreamingPipeline(object):
+    '''
+    crawl, stemming and index building running concurrently:
+    crawler threads -> page queue -> stemming processes -> result queue -> index builder thread
+    both queues are bounded, a slow stage blocks the one before it instead of buffering the whole crawl
+    produces the same files as running the `crawl`, `stemming` and `index` stages in sequence
+    '''
+
+    def __init__(self, crawler: Crawler, page_dir: str, stopword_file="stopwords.txt",
+                 num_processes=None, queue_size=64) -> None:
+        self.crawler = crawler
+        self.page_dir = page_dir
+        self.stopword_file = stopword_file
+        self.num_processes = num_processes if num_processes is not None else os.cpu_count()
+        self.page_queue = Queue(maxsize=queue_size)
+        self.result_queue = Queue()
+        # pages submitted to the stemming processes but not yet indexed, bounds the result queue
+        self.in_flight = threading.BoundedSemaphore(queue_size)
+        self.vocab = Vocabulary()
+        self.stemmer_state_path = os.path.join(page_dir, "stemmer_state.pkl")
+        # never stems, collects the caches of the stemming processes for the next run
+        self.stemmer = Stemmer(stopword_file, state_file=self.stemmer_state_path)
+        self.forward_index = []
+        self.doc_stats = {}
+        self.title_postings = {}
+        self.body_postings = {}
+        # raised by `run` once all threads are joined, a failed stage must not look like a short crawl
+        self.crawl_error = None
+        self.dispatch_error = None
+
+    @staticmethod
+    def add_postings(postings: dict, doc_id: int, word_ids: List[int], word_pos: List[int]):
+        doc_postings = {}
+        for w, p in zip(word_ids, word_pos):
+            if w not in doc_postings:
+                doc_postings[w] = [doc_id, 0, []]
+            doc_postings[w][1] += 1
+            doc_postings[w][2].append(p)
+        for w, posting in doc_postings.items():
+            postings.setdefault(w, []).append(posting)
+
+    def index_document(self, doc_id, title, size, title_words, title_pos, body_words, body_pos):
+        stemmed_title = [self.vocab.map(w) for w in title_words]
+        stemmed_body = [self.vocab.map(w) for w in body_words]
+        self.forward_index.append({
+            "id": doc_id,
+            "title": stemmed_title,
+            "title_word_pos": title_pos,
+            "body": stemmed_body,
+            "body_word_pos": body_pos,
+        })
+        stats, top_words = compute_doc_stats(doc_id, stemmed_title, stemmed_body, k=5)
+        self.doc_stats[doc_id] = stats
+        self.add_postings(self.title_postings, doc_id, stemmed_title, title_pos)
+        self.add_postings(self.body_postings, doc_id, stemmed_body, body_pos)
+        page = self.crawler.pages[doc_id]
+        invert_vocab = self.vocab.invert_dictionary()
+        page.title = title
+        page.size = size
+        page.freq_words = {invert_vocab[w]: count for w, count in top_words}
+
+    def crawl(self, num_workers: int):
+        self.crawler.on_page = self.page_queue.put
+        try:
+            self.crawler.crawl_all(num_workers)
+        except Exception as e:
+            self.crawl_error = e
+        finally:
+            self.page_queue.put(None)
+
+    def dispatch(self, executor: ProcessPoolExecutor):
+        futures = []
+        try:
+            while True:
+                page = self.page_queue.get()
+                if page is None:
+                    break
+                self.in_flight.acquire()
+                try:
+                    future = executor.submit(stem_document, page.id, page.text)
+                except Exception:
+                    self.in_flight.release()
+                    raise
+                future.doc_id = page.id
+                future.add_done_callback(self.result_queue.put)
+                futures.append(future)
+        except Exception as e:
+            # e.g. BrokenProcessPool, keep taking pages so the crawler threads don't block on the full queue
+            self.dispatch_error = e
+            while self.page_queue.get() is not None:
+                pass
+        finally:
+            for future in futures:
+                future.exception()
+            self.result_queue.put(None)
+
+    def build_index(self):
+        while True:
+            future = self.result_queue.get()
+            if future is None:
+                return
+            self.in_flight.release()
+            try:
+                document, new_splits, new_stems = future.result()
+            except Exception as e:
+                # keep draining, a stalled index builder would block the crawler through the queues
+                print(f"WARNING: failed to stem page {future.doc_id}: {e}")
+                page = self.crawler.pages[future.doc_id]
+                size = len(clean_page_text(page.text).encode("utf-8"))
+                self.index_document(future.doc_id, page.title, size, [], [], [], [])
+                continue
+            self.stemmer.split_cache.update(new_splits)
+            self.stemmer.stem_cache.update(new_stems)
+            self.index_document(*document)
+
+    def run(self, num_workers=10) -> List[Page]:
+        # spawned processes don't inherit the crawler threads, they load the pre-warmed stemmer state
+        executor = ProcessPoolExecutor(
+            max_workers=self.num_processes, mp_context=get_context("spawn"),
+            initializer=init_stem_worker, initargs=(self.stopword_file, self.stemmer_state_path))
+        crawl_thread = threading.Thread(target=self.crawl, args=(num_workers,))
+        dispatch_thread = threading.Thread(target=self.dispatch, args=(executor,))
+        with executor:
+            crawl_thread.start()
+            dispatch_thread.start()
+            self.build_index()
+            crawl_thread.join()
+            dispatch_thread.join()
+        if self.crawl_error is not None:
+            raise self.crawl_error
+        if self.dispatch_error is not None:
+            raise self.dispatch_error
+        # pagerank and dump of pages (with stemmed titles, sizes and frequent words) once the crawl is complete
+        pages, _, _ = self.crawler.finalize()
+        self.dump_index()
+        self.stemmer.save_state(self.stemmer_state_path)
+        return pages
+
+    def dump_index(self):
+        self.forward_index.sort(key=lambda x: x["id"])
+        with open(os.path.join(self.page_dir, "forward_index.json"), "w", encoding="utf-8") as f:
+            json.dump(self.forward_index, f)
+        dictionary = self.vocab.dictionary()
+        with open(os.path.join(self.page_dir, "dictionary.json"), "w") as f:
+            json.dump(dictionary, f)
+        CompactVocabulary.from_json(os.path.join(self.page_dir, "dictionary.json"), os.path.join(self.page_dir, "dictionary.bin"))
+        doc_stats = [self.doc_stats[i] for i in sorted(self.doc_stats)]
+        for field, postings in (("title", self.title_postings), ("body", self.body_postings)):
+            # pages were indexed in completion order, postings are stored by doc_id
+            inverted_index = [
+                {"id": i, "doc": sorted(postings.get(i, []), key=lambda doc: doc[0])}
+                for i in range(len(dictionary))
+            ]
+            with open(os.path.join(self.page_dir, f"{field}_inverted_index.json"), "w") as f:
+                json.dump(inverted_index, f)
+            add_magnitudes(doc_stats, inverted_index, field)
+        dump_doc_stats(doc_stats, os.path.join(self.page_dir, "doc_stats.json"))
@@ -0,0 +1,38 @@
+from page import clean_page_text
+from page_parser import PageParser
+from stemmer import Stemmer
+import itertools
+
+# code run in the stemming processes of `pipeline.StreamingPipeline`, kept apart so that
+# spawned processes only import the parser and the stemmer, not the crawler, numpy or tqdm
+
+
+# parser and stemmer of a stemming process, created once by `init_stem_worker`
+worker_state = {}
+
+
+def init_stem_worker(stopword_file: str, stemmer_state_file: str):
+    worker_state["parser"] = PageParser()
+    worker_state["stemmer"] = Stemmer(stopword_file, state_file=stemmer_state_file)
+    # cache entries already known to the parent, everything after them is sent back
+    worker_state["known"] = (len(worker_state["stemmer"].split_cache), len(worker_state["stemmer"].stem_cache))
+
+
+def stem_document(doc_id: int, text: str):
+    '''
+    parse and stem one page in a stemming process, words are mapped to word_id by the index builder
+    returns the document and the split/stem cache entries the process added since its last page
+    '''
+    text = clean_page_text(text)
+    stemmer = worker_state["stemmer"]
+    title, body = worker_state["parser"].extract_title_and_body_from_html_str(text)
+    title_words, title_pos = stemmer.stem_text(title)
+    body_words, body_pos = stemmer.stem_text(body)
+    # the caches only grow and keep insertion order, new entries are at the end
+    known_splits, known_stems = worker_state["known"]
+    new_splits = dict(itertools.islice(stemmer.split_cache.items(), known_splits, None))
+    new_stems = dict(itertools.islice(stemmer.stem_cache.items(), known_stems, None))
+    worker_state["known"] = (len(stemmer.split_cache), len(stemmer.stem_cache))
+    # title may be a bs4 string tied to the whole parse tree, send a plain copy back
+    document = (doc_id, str(title), len(text.encode("utf-8")), title_words, title_pos, body_words, body_pos)
+    return document, new_splits, new_stems
@@ -1,41 +1,99 @@
 from snowballstemmer import EnglishStemmer
 from vocabulary import Vocabulary
 import re
-import wordninja
+import os
 import math
+import pickle
 import unicodedata
 import string
 
 
+STATE_VERSION = 1
+PUNCTUATION_PATTERN = re.compile(f"[{re.escape(string.punctuation)}]")
+NON_ALPHA_PATTERN = re.compile(r'[^a-zA-Z0-9\s]')
+SPACE_PATTERN = re.compile(r'\s+')
+HYPHEN_PATTERN = re.compile(r'(?<=[a-zA-Z])-(?=[a-zA-Z])')
+
+
+def language_model(whitelist):
+    '''
+    returns wordninja's language model with whitelisted words patched in
+    wordninja builds its model when imported, so this is deferred until a word actually has to be split
+    '''
+    import wordninja
+    model = wordninja.DEFAULT_LANGUAGE_MODEL
+    for w in whitelist:
+        wordlist_len = len(model._wordcost)
+        model._wordcost[w] = math.log(
+            wordlist_len * math.log(wordlist_len)
+        )
+    return model
+
+
 class Stemmer:
-    def __init__(self, stopword_file: str, whitelist=["crawler"]) -> None:
+    def __init__(self, stopword_file: str, whitelist=["crawler"], state_file: str = None) -> None:
+        '''
+        `state_file` is a pickle written by `save_state`, it holds the stopwords and the split/stem caches
+        of a previous run, so a warm stemmer may not need to load the language model at all
+        '''
         self.stemmer = EnglishStemmer()
         self.vocab = Vocabulary()
         self.stopwords = set()
         self.punctionation_token=" 990990990 "
-        with open(stopword_file, "r") as f:
-            for word in f.readlines():
-                self.stopwords.add(word.strip())
+        self.whitelist = list(whitelist)
+        self.state_key = (STATE_VERSION, os.path.getmtime(stopword_file), tuple(self.whitelist))
+        self.model = None
+        self.split_cache = {}
+        self.stem_cache = {}
+        if state_file is None or not self.load_state(state_file):
+            with open(stopword_file, "r") as f:
+                for word in f.readlines():
+                    self.stopwords.add(word.strip())
         assert "is" in self.stopwords
-        for w in whitelist:
-            wordlist_len = len(wordninja.DEFAULT_LANGUAGE_MODEL._wordcost)
-            wordninja.DEFAULT_LANGUAGE_MODEL._wordcost[w] = math.log(
-                wordlist_len * math.log(wordlist_len)
-            )
+
+    def load_state(self, state_file: str) -> bool:
+        '''
+        returns False if the state is missing or was saved with other stopwords or whitelist
+        '''
+        if not os.path.exists(state_file):
+            return False
+        with open(state_file, "rb") as f:
+            state = pickle.load(f)
+        if state["key"] != self.state_key:
+            return False
+        self.stopwords = state["stopwords"]
+        self.split_cache = state["split_cache"]
+        self.stem_cache = state["stem_cache"]
+        return True
+
+    def save_state(self, state_file: str):
+        with open(state_file, "wb") as f:
+            pickle.dump({
+                "key": self.state_key,
+                "stopwords": self.stopwords,
+                "split_cache": self.split_cache,
+                "stem_cache": self.stem_cache,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def split(self, word: str):
+        if word not in self.split_cache:
+            if self.model is None:
+                self.model = language_model(self.whitelist)
+            self.split_cache[word] = self.model.split(word)
+        return self.split_cache[word]
 
     def replace_punctuation_and_non_alpha(self,text):
         text=text.replace("-",self.punctionation_token)
         # punctuations = r'[!"#$%&\'()*+,./:;<=>?@\[\\\]^_`{|}~]'
-        step1 = re.sub(f"[{re.escape(string.punctuation)}]", self.punctionation_token, text)
+        step1 = PUNCTUATION_PATTERN.sub(self.punctionation_token, text)
         # print(step1)
-        step2 = re.sub(r'[^a-zA-Z0-9\s]', ' ', step1)
-        result = re.sub(r'\s+', ' ', step2).strip()
+        step2 = NON_ALPHA_PATTERN.sub(' ', step1)
+        result = SPACE_PATTERN.sub(' ', step2).strip()
         return result
     
     def clean_text(self, text: str) -> str:
         text = self.remove_accents(text).lower()  # remove accent
-        lookaround_pattern = r'(?<=[a-zA-Z])-(?=[a-zA-Z])'
-        text = re.sub(lookaround_pattern, ' ', text)
+        text = HYPHEN_PATTERN.sub(' ', text)
         text=text.replace("-",self.punctionation_token)
         # remove unrecognized character
         cleaned_text=self.replace_punctuation_and_non_alpha(text)
@@ -43,7 +101,7 @@ class Stemmer:
         cleaned_text = [w for w in cleaned_text.split() if w.isalnum()]
         splited_text = []
         for w in cleaned_text:
-            splited_text += wordninja.split(w)  # handle bad concatenation
+            splited_text += self.split(w)  # handle bad concatenation
 
         # print(splited_text)
         stopword_removed_text, stopword_removed_index = [], []
@@ -61,11 +119,20 @@ class Stemmer:
         )
 
     def stem(self, word: str):
-        return self.stemmer.stemWord(word)
+        if word not in self.stem_cache:
+            self.stem_cache[word] = self.stemmer.stemWord(word)
+        return self.stem_cache[word]
+
+    def stem_text(self, content: str):
+        '''
+        returns stemmed words and their positions, without mapping them to word_id
+        '''
+        text, index = self.clean_text(content)
+        return [self.stem(w) for w in text.split(" ")], index
 
     def stem_and_map(self, content: str):
-        text, index = self.clean_text(content)
-        output = [self.vocab.map(self.stem(w)) for w in text.split(" ")]
+        words, index = self.stem_text(content)
+        output = [self.vocab.map(w) for w in words]
         return output, index
 
     def vocabulary(self):
@@ -1,3 +1,9 @@
+import json
+import mmap
+import struct
+import zlib
+
+
 class Vocabulary(object):
     def __init__(self) -> None:
         self.vocab = {}
@@ -16,3 +22,142 @@ class Vocabulary(object):
     def invert_dictionary(self):
         assert "is" not in self.invert_vocab
         return self.invert_vocab
+
+
+class IdToTerm(object):
+    '''
+    read-only word_id -> word mapping backed by a `CompactVocabulary`
+    '''
+
+    def __init__(self, vocab: "CompactVocabulary") -> None:
+        self.vocab = vocab
+
+    def __getitem__(self, word_id: int) -> str:
+        if word_id not in self:
+            raise KeyError(word_id)
+        return self.vocab.term(word_id)
+
+    def __contains__(self, word_id) -> bool:
+        return isinstance(word_id, int) and 0 <= word_id < len(self.vocab)
+
+    def __len__(self) -> int:
+        return len(self.vocab)
+
+
+class CompactVocabulary(object):
+    '''
+    a memory-mapped sorted string table, layout (little-endian uint32):
+    header [magic, n, blob_len, source_crc], offsets[n+1] of words in sorted order,
+    sorted_to_id[n], id_to_sorted[n], then the utf-8 blob of sorted words
+    word -> word_id is a binary search, word_id -> word is two array reads
+    source_crc is the crc32 of the `dictionary.json` it was built from, 0 if unknown
+    '''
+    MAGIC = b"VOC2"
+    HEADER = struct.Struct("<4sIII")
+
+    def __init__(self, buffer) -> None:
+        # `Vocabulary` is used by the stemmer, only the compact form needs numpy
+        import numpy as np
+        magic, n, blob_len, source_crc = self.HEADER.unpack_from(buffer, 0)
+        assert magic == self.MAGIC, "not a compact vocabulary file"
+        self.buffer = buffer
+        self.n = n
+        self.source_crc = source_crc
+        start = self.HEADER.size
+        self.offsets = np.frombuffer(buffer, dtype="<u4", count=n+1, offset=start)
+        start += 4*(n+1)
+        self.sorted_to_id = np.frombuffer(buffer, dtype="<u4", count=n, offset=start)
+        start += 4*n
+        self.id_to_sorted = np.frombuffer(buffer, dtype="<u4", count=n, offset=start)
+        self.blob_start = start+4*n
+
+    @staticmethod
+    def build(dictionary: dict, source_crc=0) -> bytes:
+        '''
+        serialize a word -> word_id dict, word_ids must be 0..len(dictionary)-1
+        '''
+        import numpy as np
+        n = len(dictionary)
+        assert sorted(dictionary.values()) == list(range(n)), "word_id must be dense"
+        words = sorted((w.encode("utf-8"), i) for w, i in dictionary.items())
+        offsets = np.zeros(n+1, dtype="<u4")
+        offsets[1:] = np.cumsum([len(w) for w, _ in words])
+        sorted_to_id = np.array([i for _, i in words], dtype="<u4")
+        id_to_sorted = np.empty(n, dtype="<u4")
+        id_to_sorted[sorted_to_id] = np.arange(n, dtype="<u4")
+        blob = b"".join(w for w, _ in words)
+        return b"".join([
+            CompactVocabulary.HEADER.pack(CompactVocabulary.MAGIC, n, len(blob), source_crc),
+            offsets.tobytes(), sorted_to_id.tobytes(), id_to_sorted.tobytes(), blob
+        ])
+
+    @staticmethod
+    def save(dictionary: dict, path: str, source_crc=0):
+        with open(path, "wb") as f:
+            f.write(CompactVocabulary.build(dictionary, source_crc))
+
+    @staticmethod
+    def load(path: str) -> "CompactVocabulary":
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return CompactVocabulary(buffer)
+
+    @staticmethod
+    def checksum(json_path: str) -> int:
+        with open(json_path, "rb") as f:
+            return zlib.crc32(f.read())
+
+    @staticmethod
+    def is_current(path: str, json_path: str) -> bool:
+        '''
+        returns True if `path` was built from the present content of `json_path`
+        a regenerated or checked out json makes the binary file stale, its word_ids may differ
+        '''
+        with open(path, "rb") as f:
+            header = f.read(CompactVocabulary.HEADER.size)
+        if len(header) < CompactVocabulary.HEADER.size:
+            return False
+        magic, _, _, source_crc = CompactVocabulary.HEADER.unpack(header)
+        return magic == CompactVocabulary.MAGIC and source_crc == CompactVocabulary.checksum(json_path)
+
+    @staticmethod
+    def from_json(json_path: str, path: str) -> "CompactVocabulary":
+        with open(json_path, "rb") as f:
+            content = f.read()
+        CompactVocabulary.save(json.loads(content), path, zlib.crc32(content))
+        return CompactVocabulary.load(path)
+
+    def to_json(self, json_path: str):
+        with open(json_path, "w") as f:
+            json.dump(self.dictionary(), f)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _word_at(self, pos: int) -> bytes:
+        return self.buffer[self.blob_start+int(self.offsets[pos]):self.blob_start+int(self.offsets[pos+1])]
+
+    def term(self, word_id: int) -> str:
+        return self._word_at(int(self.id_to_sorted[word_id])).decode("utf-8")
+
+    def lookup(self, word: str):
+        '''
+        returns word_id of `word`, or None if it is not in the vocabulary
+        '''
+        key = word.encode("utf-8")
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._word_at(mid) < key:
+                lo = mid+1
+            else:
+                hi = mid
+        if lo < self.n and self._word_at(lo) == key:
+            return int(self.sorted_to_id[lo])
+        return None
+
+    def dictionary(self) -> dict:
+        return {self.term(i): i for i in range(self.n)}
+
+    def invert_dictionary(self) -> IdToTerm:
+        return IdToTerm(self)